@@ -5,19 +5,26 @@ Classes:
     Batcher - determine batch size on the fly
 
 Functions:
-    do_diffusion - wrap `Batcher`
+    do_diffusion - wrap `Batcher` and queue it on `INFERENCE_QUEUE`
 
 Variables:
     LOGGER (logging.Logger) - logging
+    PROGRESS_INTERVAL (float) - minimum seconds between progress messages;
+        the final step is always sent
+    PEAK_MEMORY_PER_IMAGE (Dict[Tuple[int, int, bool], float]) - measured
+        VRAM bytes per image, keyed by width, height, and whether inpainting
 """
 
 # pylint: disable=line-too-long
 
 
 import asyncio
+import functools
+import gc
 import logging
-from math import ceil
-from typing import Callable, List, Union
+from math import ceil, inf
+import time
+from typing import Callable, Dict, List, Tuple, Union
 
 from diffusers.pipelines.stable_diffusion.pipeline_stable_diffusion_img2img import (
     preprocess,
@@ -25,17 +32,37 @@ from diffusers.pipelines.stable_diffusion.pipeline_stable_diffusion_img2img impo
 from fastapi import WebSocket
 from PIL import Image
 import torch
-from torch import autocast
 
 from consts import WebSocketResponseStatus
 from exceptions import (
     BatchSizeIsTooLargeException,
     AspectRatioTooWideException,
 )
+from inference_queue import INFERENCE_QUEUE
 from request_models import BaseDiffusionRequest, ImageArrayResponse
+from settings import SETTINGS
+from utils import image_to_base64url
 
 
 LOGGER = logging.getLogger(__name__)
+# A UNet step takes tens of milliseconds or more, so a shorter interval
+# wouldn't skip any messages.
+PROGRESS_INTERVAL = 0.25
+PEAK_MEMORY_PER_IMAGE: Dict[Tuple[int, int, bool], float] = {}
+
+
+@functools.lru_cache(maxsize=None)
+def _preprocess_stream() -> torch.cuda.Stream:
+    # Created lazily: initializing CUDA at import would happen before
+    # `settings` has set `PYTORCH_CUDA_ALLOC_CONF`.
+    return torch.cuda.Stream()
+
+
+@functools.lru_cache(maxsize=None)
+def _generator() -> torch.Generator:
+    # Reused for every seeded request; reseeding keeps results reproducible.
+    # Sharing is safe because `INFERENCE_QUEUE` runs one diffusion at a time.
+    return torch.Generator("cuda")
 
 
 class Batcher:
@@ -63,6 +90,7 @@ class Batcher:
         call_pipe - perform diffusion for each batch with a set batch size
         diffusion_method - perform diffusion on a single batch
         progress_callback - send progress back to web socket
+        send_images - send finished images back to web socket
     """
 
     def __init__(
@@ -88,13 +116,15 @@ class Batcher:
         self.progress_multiplier = 1.0
         self.progress_offset = 0.0
         self._init_image = None
+        self._last_progress_time = -inf
+        self._stream_images = False
 
     @property
     def init_image(self):
         """
         Get/set initial image.
 
-        If set to list of images, convert to tensor.
+        If set to list of images, convert to tensor and upload to the GPU.
         """
         return self._init_image
 
@@ -103,9 +133,18 @@ class Batcher:
         if isinstance(init_image, Image.Image) or init_image is None:
             self._init_image = init_image
             return
-        self._init_image = torch.stack(
+        init_image = torch.stack(
             [preprocess(i.convert("RGB")) for i in init_image]
         ).squeeze(1)
+        if torch.cuda.is_available():
+            # Upload from pinned memory on a side stream, so the copy doesn't
+            # block the event loop or wait on in-flight GPU work.
+            stream = _preprocess_stream()
+            with torch.cuda.stream(stream):
+                init_image = init_image.pin_memory().to("cuda", non_blocking=True)
+            torch.cuda.current_stream().wait_stream(stream)
+            init_image.record_stream(torch.cuda.current_stream())
+        self._init_image = init_image
 
     @property
     def num_images(self):
@@ -125,6 +164,30 @@ class Batcher:
         """Get batch size of the last batch."""
         return self.num_images % self.batch_size or self.batch_size
 
+    def _memory_key(self, kwargs: dict) -> Tuple[int, int, bool]:
+        """Get the `PEAK_MEMORY_PER_IMAGE` key for this diffusion."""
+        if isinstance(self.init_image, Image.Image):
+            width, height = self.init_image.size
+        elif isinstance(self.init_image, torch.Tensor):
+            height, width = self.init_image.shape[-2:]
+        else:
+            width, height = kwargs.get("width", 512), kwargs.get("height", 512)
+        return width, height, kwargs.get("mask") is not None
+
+    @staticmethod
+    def _max_batch_size(memory_key: Tuple[int, int, bool]) -> float:
+        """Estimate the largest batch that fits in currently free VRAM."""
+        per_image = PEAK_MEMORY_PER_IMAGE.get(memory_key)
+        if per_image is None:
+            return inf
+        free, total = torch.cuda.mem_get_info()
+        reserved = torch.cuda.memory_reserved()
+        # Device memory beyond the per-process cap can't be used.
+        free = min(free, SETTINGS.CUDA_MEMORY_FRACTION * total - reserved)
+        # Blocks held by the caching allocator are free for our purposes.
+        free += reserved - torch.cuda.memory_allocated()
+        return max(1, int(free // per_image))
+
     @property
     def _next_batch_size_to_try(self):
         """If this batch fails, return the next batch size."""
@@ -134,6 +197,9 @@ class Batcher:
         """
         Send progress back to websocket.
 
+        Messages are throttled to at most one per `PROGRESS_INTERVAL`
+        seconds, except for the final step, which is always sent.
+
         Arguments:
             batch_step (int) - timestep of the current batch
             total_batch_steps (int) - number of steps in the current batch
@@ -143,7 +209,12 @@ class Batcher:
         progress = (
             self.progress_multiplier * current_step / total_steps + self.progress_offset
         )
-        if self.websocket is not None:
+        now = time.monotonic()
+        if self.websocket is not None and (
+            now - self._last_progress_time >= PROGRESS_INTERVAL
+            or current_step == total_steps
+        ):
+            self._last_progress_time = now
             await self.websocket.send_json(
                 {
                     "status": WebSocketResponseStatus.PROGRESS,
@@ -156,6 +227,24 @@ class Batcher:
         # https://github.com/huggingface/diffusers/issues/374
         await asyncio.sleep(0)
 
+    async def send_images(self, images: List[Image.Image], start_index: int):
+        """
+        Send finished images back to websocket.
+
+        Arguments:
+            images (List[Image.Image]) - images from the current batch
+            start_index (int) - index of the first image among all images
+        """
+        for index, image in enumerate(images, start_index):
+            encoded = await asyncio.to_thread(image_to_base64url, image)
+            await self.websocket.send_json(
+                {
+                    "status": WebSocketResponseStatus.IMAGE,
+                    "index": index,
+                    "image": encoded.decode(),
+                }
+            )
+
     async def call_pipe(self, **kwargs):
         """
         Call the Diffusion pipeline.
@@ -165,36 +254,39 @@ class Batcher:
         Returns:
             images (List[Image.Image]) - images from diffusion
         """
-        with autocast("cuda"):
-            with torch.inference_mode():
-                images = []
-                for count in range(self.num_batches):
-                    self._count = count
-                    prompts = [self.request.prompt] * (
-                        self.batch_size
-                        if count + 1 < self.num_batches
-                        else self.last_batch_size
-                    )
-                    batch = (
-                        self.init_image[
-                            slice(
-                                count * self.batch_size,
-                                (count + 1) * self.batch_size,
-                            )
-                        ]
-                        if isinstance(self.init_image, torch.Tensor)
-                        else self.init_image
-                    )
-                    new_images = await self.diffusion_method(
-                        prompt=prompts,
-                        init_image=batch,
-                        num_inference_steps=self.request.num_inference_steps,
-                        guidance_scale=self.request.guidance_scale,
-                        progress_callback=self.progress_callback,
-                        **kwargs,
-                    )
-                    images.extend(new_images)
-                return images
+        # Bind once rather than creating a new bound method every batch.
+        progress_callback = self.progress_callback
+        with torch.inference_mode():
+            images = []
+            for count in range(self.num_batches):
+                self._count = count
+                prompts = [self.request.prompt] * (
+                    self.batch_size
+                    if count + 1 < self.num_batches
+                    else self.last_batch_size
+                )
+                batch = (
+                    self.init_image[
+                        slice(
+                            count * self.batch_size,
+                            (count + 1) * self.batch_size,
+                        )
+                    ]
+                    if isinstance(self.init_image, torch.Tensor)
+                    else self.init_image
+                )
+                new_images = await self.diffusion_method(
+                    prompt=prompts,
+                    init_image=batch,
+                    num_inference_steps=self.request.num_inference_steps,
+                    guidance_scale=self.request.guidance_scale,
+                    progress_callback=progress_callback,
+                    **kwargs,
+                )
+                if self._stream_images:
+                    await self.send_images(new_images, len(images))
+                images.extend(new_images)
+            return images
 
     async def do_diffusion(
         self,
@@ -204,6 +296,11 @@ class Batcher:
         """
         Perform diffusion with batch size calculated on the fly.
 
+        If `request.stream_images` is set and `return_images` is not, each
+        image is sent over the web socket as soon as its batch finishes, and
+        the returned ImageArrayResponse is empty. If a smaller batch size has
+        to be tried, images are sent again from index 0.
+
         Optional Arguments:
             return_images (bool) - return list rather than ImageArrayResponse
                 (default: `False`)
@@ -227,7 +324,7 @@ class Batcher:
                 error occurs
         """
         if self.request.seed is not None:
-            generator = torch.Generator("cuda").manual_seed(self.request.seed)
+            generator = _generator().manual_seed(self.request.seed)
         else:
             generator = None
 
@@ -235,13 +332,33 @@ class Batcher:
         self.progress_multiplier = kwargs.pop("progress_multiplier", 1.0)
         self.progress_offset = kwargs.pop("progress_offset", 0.0)
         self._count = 0
-        self.num_batches = ceil(self.num_images / self.request.batch_size)
+        self._last_progress_time = -inf
+        self._stream_images = (
+            not return_images
+            and self.websocket is not None
+            and getattr(self.request, "stream_images", False)
+        )
+        memory_key = self._memory_key(kwargs)
+        batch_size = self.request.batch_size
+        if self.request.try_smaller_batch_on_fail:
+            # Skip batch sizes which are already known not to fit.
+            batch_size = min(batch_size, self._max_batch_size(memory_key))
+        self.num_batches = min(
+            max(ceil(self.num_images / batch_size), 1), self.num_images
+        )
 
         while self.num_batches <= self.num_images:
             try:
+                torch.cuda.reset_peak_memory_stats()
+                start_memory = torch.cuda.memory_allocated()
                 images = await self.call_pipe(generator=generator, **kwargs)
+                PEAK_MEMORY_PER_IMAGE[memory_key] = (
+                    torch.cuda.max_memory_allocated() - start_memory
+                ) / self.batch_size
                 break
             except RuntimeError as exc:
+                if "out of memory" not in str(exc).lower():
+                    raise
                 if self.request.try_smaller_batch_on_fail:
                     batch_size = self.batch_size
                     while self.batch_size == self._next_batch_size_to_try:
@@ -253,12 +370,23 @@ class Batcher:
                     )
                 else:
                     raise BatchSizeIsTooLargeException(self.batch_size) from exc
+            # Only reached after an OOM. Leaving the `except` block dropped the
+            # traceback, whose frames held the failed attempt's tensors; return
+            # their blocks so the retry doesn't start from a fragmented cache.
+            gc.collect()
+            torch.cuda.empty_cache()
         else:
             raise AspectRatioTooWideException
 
+        # Batched init images live on the GPU; don't hold them while the
+        # response is encoded.
+        self._init_image = None
+
         if return_images:
             return images
-        return ImageArrayResponse(images=images)
+        if self._stream_images:
+            return ImageArrayResponse(images=[])
+        return await asyncio.to_thread(ImageArrayResponse, images=images)
 
 
 async def do_diffusion(
@@ -268,10 +396,22 @@ async def do_diffusion(
     **kwargs,
 ) -> Union[ImageArrayResponse, List[Image.Image]]:
     """
-    Wrap `Batcher`.
+    Wrap `Batcher` and queue it on `INFERENCE_QUEUE`.
+
+    Jobs are scheduled fairly per client host, weighted by the number of
+    denoising steps they'll run.
 
     See `Batcher.__init__` and `Batcher.do_diffusion` for usage.
     """
-    return await Batcher(
+    batcher = Batcher(
         request=request, diffusion_method=diffusion_method, websocket=websocket
-    ).do_diffusion(**kwargs)
+    )
+    try:
+        num_images = request.num_variants
+    except AttributeError:
+        num_images = len(kwargs["init_image"])
+    return await INFERENCE_QUEUE.submit(
+        key=websocket.client.host if websocket is not None else None,
+        func=functools.partial(batcher.do_diffusion, **kwargs),
+        cost=num_images * request.num_inference_steps,
+    )
@@ -62,6 +62,7 @@ class WebSocketResponseStatus(str, Enum):
 
     FINISHED = "finished"
     PROGRESS = "progress"
+    IMAGE = "image"
 
 
 MIN_SEED = -0x8000_0000_0000_0000
@@ -5,6 +5,8 @@ Classes:
     BaseWebSocketException - unexpected web socket error
     BatchSizeIsTooLargeException - batch doesn't fit in memory
     AspectRatioTooWideException - single image doesn't fit in memory
+    EmptyMaskException - inpainting mask has nothing to inpaint
+    InpaintingUnavailableException - inpainting model failed to load
     CouldntFixFaceException - error in face fixing
 """
 
@@ -36,6 +38,14 @@ class AspectRatioTooWideException(BaseWebSocketException):
     )
 
 
+class EmptyMaskException(BaseWebSocketException):
+    message = "Inpainting mask is empty, nothing to inpaint"
+
+
+class InpaintingUnavailableException(BaseWebSocketException):
+    message = "Inpainting model failed to load, check server logs for details"
+
+
 class CouldntFixFaceException(HTTPException):
     def __init__(self):
         super().__init__(
@@ -29,6 +29,7 @@ SOFTWARE.
 # pylint: disable=invalid-name
 
 # https://github.com/lowfuel/progrock-stable
+import asyncio
 from typing import Tuple, List
 
 from fastapi import WebSocket
@@ -37,6 +38,7 @@ from PIL.Image import Resampling
 
 from batcher import do_diffusion
 from esrgan_upscaler import upscale
+from inference_queue import INFERENCE_QUEUE
 from request_models import GoBigRequest
 from pipeline import StablePipe
 
@@ -219,11 +221,16 @@ async def do_gobig(
     # Get our render size for each slice, and our target size.
     slice_size = (512, 512)
     resampling_mode = kwargs.pop("resampling_mode", Resampling.LANCZOS)
-    target_image, slices = _prescale(
-        request,
-        input_image,
-        slice_size=slice_size,
-        resampling_mode=resampling_mode,
+    # Decoding and resizing are CPU-bound; keep them off the event loop.
+    target_image, slices = await INFERENCE_QUEUE.submit(
+        key=websocket.client.host,
+        func=lambda: asyncio.to_thread(
+            _prescale,
+            request,
+            input_image,
+            slice_size=slice_size,
+            resampling_mode=resampling_mode,
+        ),
     )
 
     # Now we perform inference on each slice.
@@ -237,7 +244,8 @@ async def do_gobig(
         strength=request.strength,
         **kwargs,
     )
-    return _splice(
+    return await asyncio.to_thread(
+        _splice,
         target_image,
         zip(better_slices, coords_x, coords_y),
         request.overlap,
@@ -0,0 +1,125 @@
+"""
+Serialize GPU work from all web socket clients.
+
+Classes:
+    InferenceQueue - run jobs one at a time with fair per-client ordering
+
+Variables:
+    QUANTUM (int) - work units credited to a client on each round
+    INFERENCE_QUEUE (InferenceQueue) - queue shared by the whole server
+"""
+
+
+import asyncio
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+
+QUANTUM = 200  # The default request: 4 variants at 50 steps.
+
+
+@dataclass
+class _Job:
+    func: Callable[[], Awaitable]
+    cost: int
+    future: asyncio.Future
+
+
+class InferenceQueue:
+    """
+    Run jobs one at a time with fair per-client ordering.
+
+    Only one job touches the GPU at once, so concurrent clients can't fight
+    over VRAM. All GPU work goes through it: diffusion, and also RealESRGAN
+    and GFPGAN.
+
+    Clients are served by Deficit Round Robin: each round a client with
+    waiting jobs is credited `QUANTUM` work units, and may run jobs while its
+    credit covers their cost. A client that floods the queue, or sends very
+    large jobs, can't starve the others.
+
+    Methods:
+        start - launch the worker on the running event loop
+        submit - queue a job and wait for its result
+        worker - run queued jobs forever
+    """
+
+    def __init__(self):
+        """Initialize InferenceQueue."""
+        self._jobs: "OrderedDict[Hashable, Deque[_Job]]" = OrderedDict()
+        self._deficits: Dict[Hashable, int] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Launch the worker on the running event loop."""
+        # The event must belong to the serving loop, not the import-time one.
+        self._wakeup = asyncio.Event()
+        self._worker_task = asyncio.create_task(self.worker())
+
+    async def submit(
+        self, key: Hashable, func: Callable[[], Awaitable], cost: int = QUANTUM
+    ) -> Any:
+        """
+        Queue a job and wait for its result.
+
+        Arguments:
+            key (Hashable) - identifies the client, for fair ordering
+            func (Callable[[], Awaitable]) - job to run
+
+        Optional Arguments:
+            cost (int) - estimated work units of the job (default: `QUANTUM`)
+
+        Returns:
+            result (Any) - whatever `func` returns
+
+        Raises:
+            RuntimeError - if `start` has not been called
+            Exception - anything raised by `func`
+        """
+        if self._wakeup is None:
+            raise RuntimeError("InferenceQueue worker has not been started")
+        job = _Job(func, max(cost, 1), asyncio.get_running_loop().create_future())
+        self._jobs.setdefault(key, deque()).append(job)
+        self._deficits.setdefault(key, 0)
+        self._wakeup.set()
+        return await job.future
+
+    async def worker(self):
+        """Run queued jobs forever."""
+        while True:
+            if not self._jobs:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            key, jobs = next(iter(self._jobs.items()))
+            self._deficits[key] += QUANTUM
+            while jobs and jobs[0].cost <= self._deficits[key]:
+                job = jobs.popleft()
+                self._deficits[key] -= job.cost
+                await self._run(job)
+
+            if jobs:
+                self._jobs.move_to_end(key)
+            else:
+                del self._jobs[key]
+                del self._deficits[key]
+
+    @staticmethod
+    async def _run(job: _Job):
+        if job.future.cancelled():
+            return
+        try:
+            result = await job.func()
+        except Exception as exc:  # pylint: disable=broad-except
+            # Handed back to the submitting handler, which reports it.
+            if not job.future.done():
+                job.future.set_exception(exc)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+
+
+INFERENCE_QUEUE = InferenceQueue()
@@ -5,21 +5,29 @@ Functions:
     authorize - authorize user's credentials
     authorize_web_socket - authorize user's credentials on the web socket
     websocket_handler - decorator to pass functions to web socket
-    text_to_image - diffusion from text
-    image_to_image - diffusion from text and image
-    inpainting - diffusion on a masked image
+    send_finished - send the final result to web socket
+    start_inference_queue - start the diffusion job worker
+    wait_for_inpainting - wait until `PIPELINE` can inpaint
+    text_to_image_kwargs - prepare diffusion from text
+    image_to_image_kwargs - prepare diffusion from text and image
+    inpainting_kwargs - prepare diffusion on a masked image
+    make_diffusion_handler - make a handler for one of `DIFFUSION_ENDPOINTS`
+    register_diffusion_endpoints - serve every one of `DIFFUSION_ENDPOINTS`
     gobig - scale up an image and diffuse details
     upscale - scale up an image
     restore_face - fix faces
     make_tilable - diffusion on image edges to be tilable
     ping - measure latency
-    setup - download models
+    warmup - populate the CUDA allocator before serving
+    setup - load models
 
 Variables:
     LOGGER (logging.Logger) - logging
     SECURITY (fastapi.security.HTTPBasic) - security credentials
     APP (FastAPI) - server application
     PIPELINE (StablePipe) - diffusion model pipeline
+    DIFFUSION_ENDPOINTS (Dict[str, Tuple]) - web socket path to request model,
+        `PIPELINE` method name, kwargs builder, and handler docstring
 """
 
 import asyncio
@@ -36,12 +44,13 @@ from json import JSONDecodeError
 #  from logging_settings import LOGGING  # noqa
 import json
 import logging
-from typing import Callable, Optional
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Type
 
 from fastapi import (
     FastAPI,
     HTTPException,
     Depends,
+    Request,
     WebSocket,
     status,
     WebSocketDisconnect,
@@ -49,7 +58,8 @@ from fastapi import (
 from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from PIL import Image, ImageChops, ImageDraw
-from torch import autocast
+from pydantic import BaseModel
+import torch
 import uvicorn
 
 #  from consts import WebSocketResponseStatus, GFPGANModel, STABLE_DIFFUSION_MODEL_NAME, \
@@ -60,15 +70,21 @@ import uvicorn
 #      FaceRestorationRequest, MakeTilableRequest, MakeTilableResponse
 #  from universal_pipeline import StableDiffusionUniversalPipeline, preprocess, preprocess_mask
 #  from utils import base64url_to_image, image_to_base64url, size_from_aspect_ratio
-from batcher import do_diffusion
-from consts import WebSocketResponseStatus, GFPGANModel
+from batcher import Batcher, do_diffusion
+from consts import WebSocketResponseStatus, GFPGANModel, ScalingMode
 import esrgan_upscaler
-from exceptions import BaseWebSocketException
+from exceptions import (
+    BaseWebSocketException,
+    EmptyMaskException,
+    InpaintingUnavailableException,
+)
 import face_restoration
 from gobig import do_gobig
+from inference_queue import INFERENCE_QUEUE
 from logging_settings import LOGGING
 from pipeline import StablePipe
 from request_models import (
+    BaseImageGenerationRequest,
     ImageToImageRequest,
     TextToImageRequest,
     GoBigRequest,
@@ -165,116 +181,204 @@ def websocket_handler(path: str, app: FastAPI) -> Callable:
     return decorator
 
 
+async def send_finished(websocket: WebSocket, response: BaseModel):
+    """
+    Send the final result back to the web socket.
+
+    `response` is serialized once, off the event loop, and spliced into the
+    message as-is rather than being parsed back and re-encoded. Response
+    models encode their images when constructed, which is just as CPU-bound,
+    so callers build them in a worker thread too.
+
+    Arguments:
+        websocket (WebSocket) - web socket
+        response (BaseModel) - result of the request
+    """
+    result = await asyncio.to_thread(response.json)
+    status_json = json.dumps(WebSocketResponseStatus.FINISHED.value)
+    await websocket.send_text(f'{{"status": {status_json}, "result": {result}}}')
+
+
 APP = FastAPI(dependencies=[Depends(authorize)])
 APP.add_middleware(GZipMiddleware, minimum_size=1000)
 
 PIPELINE: Optional[StablePipe] = None
 
-# TODO task queue?
-#  (or can set up an external scheduler and use this as internal endpoint)
-@websocket_handler("/text_to_image", APP)
-async def text_to_image(websocket: WebSocket):
-    """Perform diffusion from a text prompt."""
-    request = TextToImageRequest(**(await websocket.receive_json()))
+
+@APP.on_event("startup")
+async def start_inference_queue():
+    """Start the worker which runs all diffusion jobs one at a time."""
+    INFERENCE_QUEUE.start()
+
+
+async def wait_for_inpainting():
+    """
+    Wait until `PIPELINE` can inpaint.
+
+    Waits outside `INFERENCE_QUEUE`, so other clients aren't held up while
+    the inpainting model loads.
+
+    Raises:
+        InpaintingUnavailableException - if the inpainting model didn't load
+    """
+    try:
+        await PIPELINE.wait_for_inpainting()
+    except Exception as exc:
+        raise InpaintingUnavailableException from exc
+
+
+async def text_to_image_kwargs(request: TextToImageRequest) -> dict:
+    """Get `do_diffusion` kwargs for diffusion from a text prompt."""
     width, height = size_from_aspect_ratio(request.aspect_ratio, request.scaling_mode)
-    response = await do_diffusion(
-        request, PIPELINE.text_to_image, websocket, height=height, width=width
-    )
-    await websocket.send_json(
-        {
-            "status": WebSocketResponseStatus.FINISHED,
-            "result": json.loads(response.json()),
-        }
-    )
+    return {"height": height, "width": width}
 
 
-@websocket_handler("/image_to_image", APP)
-async def image_to_image(websocket: WebSocket):
-    """Perform diffusion from a text prompt and starting image."""
-    request = ImageToImageRequest(**(await websocket.receive_json()))
-    source_image = base64url_to_image(request.source_image)
+async def image_to_image_kwargs(request: ImageToImageRequest) -> dict:
+    """Get `do_diffusion` kwargs for diffusion from a prompt and image."""
+    source_image = await asyncio.to_thread(base64url_to_image, request.source_image)
     aspect_ratio = source_image.width / source_image.height
     size = size_from_aspect_ratio(aspect_ratio, request.scaling_mode)
-    response = await do_diffusion(
-        request,
-        PIPELINE.image_to_image,
-        websocket,
-        init_image=source_image.resize(size),
-        strength=request.strength,
-    )
-    await websocket.send_json(
-        {
-            "status": WebSocketResponseStatus.FINISHED,
-            "result": json.loads(response.json()),
-        }
-    )
+    init_image = await asyncio.to_thread(source_image.resize, size)
+    return {"init_image": init_image, "strength": request.strength}
 
 
-@websocket_handler("/inpainting", APP)
-async def inpainting(websocket: WebSocket):
-    """Perform diffusion from a text prompt on masked areas of an image."""
-    request = InpaintingRequest(**(await websocket.receive_json()))
-    source_image = base64url_to_image(request.source_image)
+async def inpainting_kwargs(request: InpaintingRequest) -> dict:
+    """Get `do_diffusion` kwargs for diffusion on masked areas of an image."""
+    source_image = await asyncio.to_thread(base64url_to_image, request.source_image)
     aspect_ratio = source_image.width / source_image.height
     size = size_from_aspect_ratio(aspect_ratio, request.scaling_mode)
     mask = None
     if request.mask:
-        mask = base64url_to_image(request.mask).resize(size)
-    # TODO return error if mask empty
-    response = await do_diffusion(
-        request,
-        PIPELINE.image_to_image,
-        websocket,
-        init_image=source_image.resize(size).convert("RGB"),
-        strength=request.strength,
-        mask=mask,
-    )
-    await websocket.send_json(
-        {
-            "status": WebSocketResponseStatus.FINISHED,
-            "result": json.loads(response.json()),
-        }
+        mask = await asyncio.to_thread(
+            lambda: base64url_to_image(request.mask).resize(size).convert("L")
+        )
+        # Checked on the CPU, before any GPU work is queued.
+        if mask.getextrema()[1] == 0:
+            raise EmptyMaskException
+        await wait_for_inpainting()
+    init_image = await asyncio.to_thread(
+        lambda: source_image.resize(size).convert("RGB")
     )
+    return {"init_image": init_image, "strength": request.strength, "mask": mask}
+
+
+DIFFUSION_ENDPOINTS: Dict[
+    str,
+    Tuple[
+        Type[BaseImageGenerationRequest],
+        str,
+        Callable[[BaseImageGenerationRequest], Awaitable[dict]],
+        str,
+    ],
+] = {
+    "/text_to_image": (
+        TextToImageRequest,
+        "text_to_image",
+        text_to_image_kwargs,
+        "Perform diffusion from a text prompt.",
+    ),
+    "/image_to_image": (
+        ImageToImageRequest,
+        "image_to_image",
+        image_to_image_kwargs,
+        "Perform diffusion from a text prompt and starting image.",
+    ),
+    "/inpainting": (
+        InpaintingRequest,
+        "image_to_image",
+        inpainting_kwargs,
+        "Perform diffusion from a text prompt on masked areas of an image.",
+    ),
+}
+
+
+def make_diffusion_handler(
+    path: str,
+    request_model: Type[BaseImageGenerationRequest],
+    method_name: str,
+    get_kwargs: Callable[[BaseImageGenerationRequest], Awaitable[dict]],
+    doc: str,
+) -> Callable:
+    """
+    Make a web socket handler for one of `DIFFUSION_ENDPOINTS`.
+
+    Arguments:
+        path (str) - web socket path the handler serves
+        request_model (Type[BaseImageGenerationRequest]) - parses the request
+        method_name (str) - name of the `PIPELINE` method to diffuse with
+        get_kwargs (Callable) - builds `do_diffusion` kwargs from the request
+        doc (str) - handler docstring
+
+    Returns:
+        handler (Callable) - to be passed to `websocket_handler`
+    """
+
+    async def handler(websocket: WebSocket):
+        request = request_model(**(await websocket.receive_json()))
+        response = await do_diffusion(
+            request,
+            getattr(PIPELINE, method_name),
+            websocket,
+            **(await get_kwargs(request)),
+        )
+        await send_finished(websocket, response)
+
+    # Route names come from the handler's name, so keep them distinct.
+    handler.__name__ = path.lstrip("/")
+    handler.__doc__ = doc
+    return handler
+
+
+def register_diffusion_endpoints():
+    """Serve a web socket handler for every one of `DIFFUSION_ENDPOINTS`."""
+    for path, endpoint in DIFFUSION_ENDPOINTS.items():
+        websocket_handler(path, APP)(make_diffusion_handler(path, *endpoint))
+
+
+register_diffusion_endpoints()
 
 
 @websocket_handler("/gobig", APP)
 async def gobig(websocket: WebSocket):
     """Scale up and perform piecewise diffusion on an image."""
     request = GoBigRequest(**(await websocket.receive_json()))
+    input_image = await asyncio.to_thread(base64url_to_image, request.image)
     upscaled = await do_gobig(
         request=request,
         websocket=websocket,
-        input_image=base64url_to_image(request.image),
+        input_image=input_image,
         pipeline=PIPELINE,
     )
-    response = ImageResponse(image=image_to_base64url(upscaled))
-    await websocket.send_json(
-        {
-            "status": WebSocketResponseStatus.FINISHED,
-            "result": json.loads(response.json()),
-        }
-    )
+    response = await asyncio.to_thread(ImageResponse, image=upscaled)
+    await send_finished(websocket, response)
+
+
+def _upscale(request: UpscaleRequest) -> ImageResponse:
+    source_image = base64url_to_image(request.image)
+    while (
+        source_image.width < request.target_width
+        or source_image.height < request.target_height
+    ):
+        source_image = esrgan_upscaler.upscale(
+            image=source_image, model_type=request.model
+        )
+
+    if not request.maximize:
+        source_image = source_image.resize(
+            (request.target_width, request.target_height)
+        )
+
+    return ImageResponse(image=image_to_base64url(source_image))
 
 
 @APP.post("/upscale")
-async def upscale(request: UpscaleRequest) -> ImageResponse:
+async def upscale(request: UpscaleRequest, http_request: Request) -> ImageResponse:
     """Scale up an image using RealESRGAN."""
     try:
-        source_image = base64url_to_image(request.image)
-        while (
-            source_image.width < request.target_width
-            or source_image.height < request.target_height
-        ):
-            source_image = esrgan_upscaler.upscale(
-                image=source_image, model_type=request.model
-            )
-
-        if not request.maximize:
-            source_image = source_image.resize(
-                (request.target_width, request.target_height)
-            )
-
-        return ImageResponse(image=image_to_base64url(source_image))
+        return await INFERENCE_QUEUE.submit(
+            key=http_request.client.host,
+            func=lambda: asyncio.to_thread(_upscale, request),
+        )
     except RuntimeError as exc:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -282,14 +386,7 @@ async def upscale(request: UpscaleRequest) -> ImageResponse:
         ) from exc
 
 
-@APP.post("/restore_face")
-async def restore_face(request: FaceRestorationRequest) -> ImageResponse:
-    """Fix faces using GFPGAN."""
-    if request.model_type == GFPGANModel.V1:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="GFPGAN v1 model is not supported",
-        )
+def _restore_face(request: FaceRestorationRequest) -> ImageResponse:
     return ImageResponse(
         image=face_restoration.restore_face(
             image=base64url_to_image(request.image),
@@ -303,37 +400,53 @@ async def restore_face(request: FaceRestorationRequest) -> ImageResponse:
     )
 
 
+@APP.post("/restore_face")
+async def restore_face(
+    request: FaceRestorationRequest, http_request: Request
+) -> ImageResponse:
+    """Fix faces using GFPGAN."""
+    if request.model_type == GFPGANModel.V1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="GFPGAN v1 model is not supported",
+        )
+    return await INFERENCE_QUEUE.submit(
+        key=http_request.client.host,
+        func=lambda: asyncio.to_thread(_restore_face, request),
+    )
+
+
 @websocket_handler("/make_tilable", APP)
 async def make_tilable(websocket: WebSocket):
     """Perform diffusion on image edges to make it tilable."""
     # pylint: disable=invalid-name
     request = MakeTilableRequest(**(await websocket.receive_json()))
-    source_image = base64url_to_image(request.source_image)
+    await wait_for_inpainting()
+    source_image = await asyncio.to_thread(base64url_to_image, request.source_image)
     aspect_ratio = source_image.width / source_image.height
     size = size_from_aspect_ratio(aspect_ratio, request.scaling_mode)
-    horizontal_offset_image = ImageChops.offset(
-        source_image.resize(size), int(size[0] / 2), 0
+    horizontal_offset_image = await asyncio.to_thread(
+        lambda: ImageChops.offset(source_image.resize(size), int(size[0] / 2), 0)
     )
     request.num_variants = 1  # TODO: actually respect user's choice
     # Horizontal offset
-    with autocast("cuda"):
-        gradient_width = request.border_width * request.border_softness
-        if int(gradient_width) != 0:
-            gradient_step = 255 / gradient_width
-        else:
-            gradient_step = 255
-
-        horizontal_mask = Image.new("L", size, color=0x00)
-        start_gradient_x = size[0] / 2 - request.border_width
-        horizontal_draw = ImageDraw.Draw(horizontal_mask)
-        for i in range(int(gradient_width)):
-            fill_color = min(int(i * gradient_step), 255)
-            x = int(start_gradient_x + i)
-            width = (request.border_width - i) * 2
-            horizontal_draw.rectangle(((x, 0), (x + width, size[1])), fill=fill_color)
-        x = int(start_gradient_x + gradient_width)
-        width = (request.border_width - gradient_width) * 2
-        horizontal_draw.rectangle(((x, 0), (x + width, size[1])), fill=255)
+    gradient_width = request.border_width * request.border_softness
+    if int(gradient_width) != 0:
+        gradient_step = 255 / gradient_width
+    else:
+        gradient_step = 255
+
+    horizontal_mask = Image.new("L", size, color=0x00)
+    start_gradient_x = size[0] / 2 - request.border_width
+    horizontal_draw = ImageDraw.Draw(horizontal_mask)
+    for i in range(int(gradient_width)):
+        fill_color = min(int(i * gradient_step), 255)
+        x = int(start_gradient_x + i)
+        width = (request.border_width - i) * 2
+        horizontal_draw.rectangle(((x, 0), (x + width, size[1])), fill=fill_color)
+    x = int(start_gradient_x + gradient_width)
+    width = (request.border_width - gradient_width) * 2
+    horizontal_draw.rectangle(((x, 0), (x + width, size[1])), fill=255)
 
     horizontal_offset_result = await do_diffusion(
         request,
@@ -347,31 +460,30 @@ async def make_tilable(websocket: WebSocket):
     )
 
     # Vertical offset
-    with autocast("cuda"):
-        #  vertical_offset_images = []
-        #  for image in horizontal_offset_result:
-        #      vertical_offset_image = ImageChops.offset(
-        #          image, 0, int(size[1] / 2)
-        #      )
-        #      vertical_offset_images.append(
-        #          vertical_offset_image
-        #      )
-        vertical_offset_image = ImageChops.offset(
-            horizontal_offset_result[0], 0, int(size[1] / 2)
-        )
+    #  vertical_offset_images = []
+    #  for image in horizontal_offset_result:
+    #      vertical_offset_image = ImageChops.offset(
+    #          image, 0, int(size[1] / 2)
+    #      )
+    #      vertical_offset_images.append(
+    #          vertical_offset_image
+    #      )
+    vertical_offset_image = ImageChops.offset(
+        horizontal_offset_result[0], 0, int(size[1] / 2)
+    )
 
-        vertical_mask = Image.new("L", size, color=0x00)
-        start_gradient_y = size[1] / 2 - request.border_width
-        vertical_draw = ImageDraw.Draw(vertical_mask)
-        for i in range(int(gradient_width)):
-            fill_color = min(int(i * gradient_step), 255)
-            y = int(start_gradient_y + i)
-            height = (request.border_width - i) * 2
-            vertical_draw.rectangle(((0, y), (size[0], y + height)), fill=fill_color)
+    vertical_mask = Image.new("L", size, color=0x00)
+    start_gradient_y = size[1] / 2 - request.border_width
+    vertical_draw = ImageDraw.Draw(vertical_mask)
+    for i in range(int(gradient_width)):
+        fill_color = min(int(i * gradient_step), 255)
+        y = int(start_gradient_y + i)
+        height = (request.border_width - i) * 2
+        vertical_draw.rectangle(((0, y), (size[0], y + height)), fill=fill_color)
 
-        y = int(start_gradient_y + gradient_width)
-        height = (request.border_width - gradient_width) * 2
-        vertical_draw.rectangle(((0, y), (size[0], y + height)), fill=255)
+    y = int(start_gradient_y + gradient_width)
+    height = (request.border_width - gradient_width) * 2
+    vertical_draw.rectangle(((0, y), (size[0], y + height)), fill=255)
 
     vertical_offset_result = await do_diffusion(
         request,
@@ -387,30 +499,29 @@ async def make_tilable(websocket: WebSocket):
     )
 
     # Center
-    with autocast("cuda"):
-        #  center_offset_images = []
-        #  for image in vertical_offset_result:
-        #      center_offset_image = ImageChops.offset(
-        #          image, -int(size[0] / 2), 0
-        #      )
-        #      center_offset_images.append(center_offset_image)
-        center_offset_image = ImageChops.offset(
-            vertical_offset_result[0], -int(size[0] / 2), 0
-        )
+    #  center_offset_images = []
+    #  for image in vertical_offset_result:
+    #      center_offset_image = ImageChops.offset(
+    #          image, -int(size[0] / 2), 0
+    #      )
+    #      center_offset_images.append(center_offset_image)
+    center_offset_image = ImageChops.offset(
+        vertical_offset_result[0], -int(size[0] / 2), 0
+    )
 
-        center_mask = Image.new("L", size, color=0x00)
-        center_draw = ImageDraw.Draw(center_mask)
-        for i in range(int(gradient_width)):
-            fill_color = min(int(i * gradient_step), 255)
-            y = int(start_gradient_y + i)
-            x = int(start_gradient_x + i)
-            offset = (request.border_width - i) * 2
-            center_draw.rectangle(((x, y), (x + offset, y + offset)), fill=fill_color)
+    center_mask = Image.new("L", size, color=0x00)
+    center_draw = ImageDraw.Draw(center_mask)
+    for i in range(int(gradient_width)):
+        fill_color = min(int(i * gradient_step), 255)
+        y = int(start_gradient_y + i)
+        x = int(start_gradient_x + i)
+        offset = (request.border_width - i) * 2
+        center_draw.rectangle(((x, y), (x + offset, y + offset)), fill=fill_color)
 
-        y = int(start_gradient_y + gradient_width)
-        x = int(start_gradient_x + gradient_width)
-        offset = (request.border_width - gradient_width) * 2
-        center_draw.rectangle(((x, y), (x + offset, y + offset)), fill=255)
+    y = int(start_gradient_y + gradient_width)
+    x = int(start_gradient_x + gradient_width)
+    offset = (request.border_width - gradient_width) * 2
+    center_draw.rectangle(((x, y), (x + offset, y + offset)), fill=255)
 
     images = await do_diffusion(
         request,
@@ -425,19 +536,16 @@ async def make_tilable(websocket: WebSocket):
         mask=center_mask,
     )
 
-    response = MakeTilableResponse(
-        images=[ImageChops.offset(image, 0, -int(size[1] / 2)) for image in images],
-        mask=ImageChops.lighter(
-            ImageChops.offset(horizontal_mask, -int(size[0] / 2), 0),
-            ImageChops.offset(vertical_mask, 0, -int(size[1] / 2)),
-        ),
-    )
-    await websocket.send_json(
-        {
-            "status": WebSocketResponseStatus.FINISHED,
-            "result": json.loads(response.json()),
-        }
+    response = await asyncio.to_thread(
+        lambda: MakeTilableResponse(
+            images=[ImageChops.offset(image, 0, -int(size[1] / 2)) for image in images],
+            mask=ImageChops.lighter(
+                ImageChops.offset(horizontal_mask, -int(size[0] / 2), 0),
+                ImageChops.offset(vertical_mask, 0, -int(size[1] / 2)),
+            ),
+        )
     )
+    await send_finished(websocket, response)
 
 
 @APP.get("/ping")
@@ -446,16 +554,45 @@ async def ping():
     return
 
 
+async def warmup():
+    """
+    Run a throwaway diffusion at the default batch and image size.
+
+    This populates the CUDA caching allocator up front, so the first real
+    request doesn't pay for fresh allocations, and measures the VRAM needed
+    per image, so requests can skip batch sizes which won't fit.
+    """
+    request = TextToImageRequest(prompt="", num_inference_steps=2)
+    request.num_variants = request.batch_size
+    width, height = size_from_aspect_ratio(request.aspect_ratio, ScalingMode.GROW)
+    try:
+        # Bypasses `INFERENCE_QUEUE`, whose worker only runs once serving.
+        await Batcher(request, PIPELINE.text_to_image, None).do_diffusion(
+            return_images=True, height=height, width=width
+        )
+    except BaseWebSocketException as exc:
+        LOGGER.warning("Warmup failed: %s", exc.message)
+
+
 async def setup():
     """Load Stable Diffusion pipeline."""
     global PIPELINE
     try:
+        torch.cuda.set_per_process_memory_fraction(SETTINGS.CUDA_MEMORY_FRACTION)
         PIPELINE = StablePipe(
             cache_dir=SETTINGS.DIFFUSERS_CACHE_PATH,
             optimized=SETTINGS.USE_OPTIMIZED_MODE,
         )
         if SETTINGS.USE_OPTIMIZED_MODE:
-            PIPELINE.enable_attention_slicing()
+            PIPELINE.enable_memory_efficient_attention()
+            PIPELINE.enable_vae_slicing()
+        if SETTINGS.QUANTIZE_TEXT_ENCODER:
+            PIPELINE.quantize_text_encoder()
+        if SETTINGS.USE_TORCH_COMPILE:
+            # Batch sizes vary with the OOM retry, so let shapes be dynamic
+            # rather than recompiling for each one mid-request.
+            PIPELINE.compile(fullgraph=False)
+        await warmup()
     except Exception as exception:
         LOGGER.error("Caught exception while initializing stable diffusion.")
         LOGGER.exception(exception)
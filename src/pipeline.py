@@ -3,17 +3,26 @@ Provide a wrapper around diffusers' stable diffusion pipelines.
 
 Classes:
     StablePipe - wrapper for both img2img and inpaint pipelines
+
+Variables:
+    LOGGER (logging.Logger) - logging
 """
 
 
+import asyncio
+from concurrent.futures import Future
+import functools
 import gc
 import inspect
+import logging
 import re
+import threading
 from typing import Awaitable, Callable, List, Optional, Union
 
 from PIL import Image
 import torch
 from torchvision import transforms
+from diffusers.models.vae import DecoderOutput
 from diffusers.pipelines.stable_diffusion import (
     StableDiffusionImg2ImgPipeline,
     StableDiffusionInpaintPipeline,
@@ -29,6 +38,8 @@ from consts import (
     STABLE_DIFFUSION_16B_REVISION,
 )
 
+LOGGER = logging.getLogger(__name__)
+
 
 # ----------------------------- This gets messy. -----------------------------
 # Why this messy solution was chosen:
@@ -92,13 +103,74 @@ _async_patch(StableDiffusionInpaintPipeline, "timesteps_tensor")
 # -------------------------------- End mess. --------------------------------
 
 
+def _quantize_linear_layers(module: torch.nn.Module) -> torch.nn.Module:
+    """
+    Replace, in place, every `nn.Linear` in `module` with an int8 layer.
+
+    `module` must be on the CPU; weights are quantized when it is then moved
+    to the GPU.
+    """
+    # pylint: disable=import-outside-toplevel
+    # bitsandbytes is only needed, and only installed, for this option.
+    try:
+        from bitsandbytes.nn import Int8Params, Linear8bitLt
+    except ModuleNotFoundError as exc:
+        raise ModuleNotFoundError(
+            "Quantizing the text encoder requires `bitsandbytes`"
+        ) from exc
+
+    for name, child in module.named_children():
+        if isinstance(child, torch.nn.Linear):
+            int8_layer = Linear8bitLt(
+                child.in_features,
+                child.out_features,
+                bias=child.bias is not None,
+                has_fp16_weights=False,
+            )
+            int8_layer.weight = Int8Params(
+                child.weight.data, requires_grad=False, has_fp16_weights=False
+            )
+            if child.bias is not None:
+                int8_layer.bias = child.bias
+            setattr(module, name, int8_layer)
+        else:
+            _quantize_linear_layers(child)
+    return module
+
+
+def _slice_vae_decode(vae):
+    """
+    Patch, in place, `vae.decode` to decode one latent at a time.
+
+    Stand-in for `enable_vae_slicing` on diffusers versions which lack it.
+    """
+    decode = vae.decode
+
+    @functools.wraps(decode)
+    def sliced_decode(z, return_dict=True):
+        sample = torch.cat([decode(z_slice).sample for z_slice in z.split(1)])
+        if not return_dict:
+            return (sample,)
+        return DecoderOutput(sample=sample)
+
+    vae.decode = sliced_decode
+
+
+def _report_load_failure(loading: Future):
+    exception = loading.exception()
+    if exception is not None:
+        LOGGER.exception("Couldn't load the inpainting model", exc_info=exception)
+
+
 class StablePipe:
     """
     Wrapper around diffusers' stable diffusion pipelines.
 
     Easily swap `StableDiffusionImg2ImgPipeline` and
     `StableDiffusionInpaintPipeline` between CPU and GPU. Intelligently choose
-    which model is needed for which task.
+    which model is needed for which task. The inpainting model loads in a
+    background thread, so the img2img model can be used before it is ready;
+    await `wait_for_inpainting` before inpainting.
 
     Instance Attributes:
         device (`torch.device`, read-only) - which device the active model uses
@@ -106,7 +178,13 @@ class StablePipe:
 
     Methods:
         enable_attention_slicing - better memory performance
+        enable_memory_efficient_attention - better memory and speed
+            performance
+        enable_vae_slicing - better memory performance
+        quantize_text_encoder - better memory performance
+        compile - better speed performance
         disable_attention_slicing - better speed performance
+        wait_for_inpainting - wait until the inpainting model has loaded
         text_to_image - text prompt to image
         image_to_image - image and text prompt to image
     """
@@ -143,46 +221,178 @@ class StablePipe:
             revision = None
 
         self._mode = "img2img"
-        self._pipe = StableDiffusionImg2ImgPipeline.from_pretrained(
-            model_name,
-            use_auth_token=True,
-            safety_checker=None,
-            torch_dtype=torch_dtype,
-            revision=revision,
+        self._text_encoder_quantized = False
+        # Applied to every pipeline, including ones loaded later.
+        self._setup_steps: List[Callable] = []
+        self._inpaint_version = inpaint_version
+        self._load_kwargs = {
+            "use_auth_token": True,
+            "safety_checker": None,
+            "torch_dtype": torch_dtype,
+            "revision": revision,
             **kwargs,
+        }
+        self._pipe = StableDiffusionImg2ImgPipeline.from_pretrained(
+            model_name, **self._load_kwargs
         ).to("cuda")
         self._pipe.set_progress_bar_config(dynamic_ncols=True)
-        self._inpaint_pipe = StableDiffusionInpaintPipeline.from_pretrained(
-            inpaint_version,
-            use_auth_token=True,
-            safety_checker=None,
-            torch_dtype=torch_dtype,
-            revision=revision,
-            **kwargs,
-        )
-        self._inpaint_pipe.set_progress_bar_config(dynamic_ncols=True)
+        self._inpaint_pipe: Optional[StableDiffusionInpaintPipeline] = None
+        # Guards `_setup_steps` against the background load replaying them.
+        self._setup_lock = threading.Lock()
+        self._inpaint_loading: Future = Future()
+        self._inpaint_loading.add_done_callback(_report_load_failure)
+        # A daemon, so a failed startup can exit without waiting for the load.
+        threading.Thread(target=self._load_inpaint_pipe, daemon=True).start()
+
+    def _load_inpaint_pipe(self):
+        try:
+            pipe = StableDiffusionInpaintPipeline.from_pretrained(
+                self._inpaint_version, **self._load_kwargs
+            )
+            pipe.set_progress_bar_config(dynamic_ncols=True)
+            with self._setup_lock:
+                for setup_step in self._setup_steps:
+                    setup_step(pipe)
+                self._inpaint_pipe = pipe
+        except Exception as exc:  # pylint: disable=broad-except
+            # Handed to `wait_for_inpainting` callers, and logged.
+            self._inpaint_loading.set_exception(exc)
+        else:
+            self._inpaint_loading.set_result(None)
+
+    def _loaded_pipes(self):
+        yield self._pipe
+        if self._inpaint_pipe is not None:
+            yield self._inpaint_pipe
 
-    def enable_attention_slicing(self):
-        """Enable attention slicing for better memory management."""
-        self._pipe.enable_attention_slicing()
-        self._inpaint_pipe.enable_attention_slicing()
+    def _configure(self, setup_step: Callable):
+        with self._setup_lock:
+            self._setup_steps.append(setup_step)
+            for pipe in self._loaded_pipes():
+                setup_step(pipe)
+
+    async def wait_for_inpainting(self):
+        """
+        Wait until the inpainting model has loaded.
+
+        Raises:
+            Exception - whatever stopped the inpainting model from loading
+        """
+        await asyncio.wrap_future(self._inpaint_loading)
+
+    def enable_attention_slicing(self, slice_size: Union[str, int] = "auto"):
+        """
+        Enable attention slicing for better memory management.
+
+        Optional Arguments:
+            slice_size (Union[str, int]) - "auto" to halve the attention
+                heads, or the number of slices to compute at once
+                (default: "auto")
+        """
+        self._configure(lambda pipe: pipe.enable_attention_slicing(slice_size))
+
+    def quantize_text_encoder(self):
+        """
+        Quantize the text encoder to int8 for better memory performance.
+
+        Requires `bitsandbytes`. Both checkpoints use the same frozen CLIP
+        ViT-L/14 text encoder, so one quantized copy is shared by both
+        pipelines. It stays on the GPU; int8 weights can't round-trip through
+        the CPU, so switching `mode` only moves the UNet and VAE.
+
+        Only the linear layers are quantized: of the encoder's 123M
+        parameters, 85M go from 16 to 8 bits, while the 38M in the token
+        embedding stay 16-bit. It then takes ~161 MB of VRAM rather than
+        ~246 MB, and the inpainting pipeline's own copy is dropped.
+        """
+        # bitsandbytes only quantizes on a CPU -> GPU move, and the img2img
+        # pipeline is already on the GPU.
+        text_encoder = _quantize_linear_layers(
+            self._pipe.text_encoder.to("cpu")
+        ).to("cuda")
+
+        def share_text_encoder(pipe):
+            pipe.text_encoder = text_encoder
+
+        self._configure(share_text_encoder)
+        self._text_encoder_quantized = True
+
+    def compile(self, **kwargs):
+        """
+        Compile the UNet and VAE decoder with `torch.compile`.
+
+        Kwargs are passed to `torch.compile`. Modes which capture CUDA graphs
+        are refused: graphs depend on fixed parameter addresses, and switching
+        `mode` moves the parameters between CPU and GPU.
+
+        Raises:
+            RuntimeError - if the installed torch has no `torch.compile`
+            ValueError - if `mode` captures CUDA graphs
+        """
+        if not hasattr(torch, "compile"):
+            raise RuntimeError(
+                f"torch.compile requires torch 2.0, but found {torch.__version__}"
+            )
+        if kwargs.get("mode") in ("reduce-overhead", "max-autotune"):
+            raise ValueError(
+                f'`mode` "{kwargs["mode"]}" captures CUDA graphs, which break '
+                "when StablePipe moves models between CPU and GPU"
+            )
+
+        def compile_pipe(pipe):
+            pipe.unet = torch.compile(pipe.unet, **kwargs)
+            pipe.vae.decode = torch.compile(pipe.vae.decode, **kwargs)
+
+        self._configure(compile_pipe)
+
+    def enable_vae_slicing(self):
+        """Decode batches one image at a time for better memory management."""
+
+        def slice_vae(pipe):
+            try:
+                pipe.enable_vae_slicing()
+            except AttributeError:
+                _slice_vae_decode(pipe.vae)
+
+        self._configure(slice_vae)
+
+    def enable_memory_efficient_attention(self):
+        """
+        Enable xFormers attention for better memory management and speed.
+
+        Falls back to maximal attention slicing if xFormers is unavailable.
+        """
+
+        def efficient_attention(pipe):
+            try:
+                pipe.enable_xformers_memory_efficient_attention()
+            except (AttributeError, ModuleNotFoundError):
+                # Older diffusers lack the method; xFormers may not be installed.
+                pipe.enable_attention_slicing(1)
+
+        self._configure(efficient_attention)
 
     def disable_attention_slicing(self):
         """Disable attention slicing for better speed."""
-        self._pipe.disable_attention_slicing()
-        self._inpaint_pipe.disable_attention_slicing()
+        self._configure(lambda pipe: pipe.disable_attention_slicing())
+
+    def _autocast(self) -> torch.autocast:
+        # 16-bit weights need no autocast; 32-bit weights (not `optimized`)
+        # rely on it to run in half precision.
+        return torch.autocast("cuda", enabled=self._pipe.vae.dtype == torch.float32)
 
     @torch.no_grad()
     def _init_image(self, height: int, width: int) -> Image.Image:
         latents = torch.randn(
             (1, self._pipe.unet.in_channels, height // 8, width // 8),
             device="cuda",
-            dtype=torch.float16,
+            dtype=self._pipe.vae.dtype,
         )
-        latents = 1 / 0.18215 * latents
-        with torch.autocast("cuda"):
+        # In-place ops avoid allocating a temporary tensor per operation.
+        latents.div_(0.18215)
+        with self._autocast():
             init_tensor = self._pipe.vae.decode(latents)
-        init_tensor = (init_tensor["sample"] / 2 + 0.5).clamp(0, 1)
+        init_tensor = init_tensor["sample"].div_(2).add_(0.5).clamp_(0, 1)
         return transforms.ToPILImage()(init_tensor[0])
 
     async def text_to_image(
@@ -244,31 +454,45 @@ class StablePipe:
         kwargs["guidance_scale"] = kwargs.pop("guidance_scale", 6.0)
         if mask is None:
             self.mode = "img2img"
-            result = await self._pipe(
-                prompt=prompt,
-                init_image=init_image.convert("RGB")
-                if isinstance(init_image, Image.Image)
-                else init_image,
-                callback=progress_callback,
-                **kwargs,
-            )
+            with self._autocast():
+                result = await self._pipe(
+                    prompt=prompt,
+                    init_image=init_image.convert("RGB")
+                    if isinstance(init_image, Image.Image)
+                    else init_image,
+                    callback=progress_callback,
+                    **kwargs,
+                )
         else:
+            if self._inpaint_pipe is None:
+                raise RuntimeError(
+                    "Inpainting model isn't loaded, await `wait_for_inpainting`"
+                )
             self.mode = "inpaint"
-            result = await self._inpaint_pipe(
-                prompt=prompt,
-                image=init_image.convert("RGB")
-                if isinstance(init_image, Image.Image)
-                else init_image,
-                mask_image=mask,
-                height=init_image.height,
-                width=init_image.width,
-                callback=progress_callback,
-                **kwargs,
-            )
+            with self._autocast():
+                result = await self._inpaint_pipe(
+                    prompt=prompt,
+                    image=init_image.convert("RGB")
+                    if isinstance(init_image, Image.Image)
+                    else init_image,
+                    mask_image=mask,
+                    height=init_image.height,
+                    width=init_image.width,
+                    callback=progress_callback,
+                    **kwargs,
+                )
+        # Blocks stay in the caching allocator for the next request; the
+        # allocator frees them by itself before raising an OOM.
         gc.collect()
-        torch.cuda.empty_cache()
         return result["images"]
 
+    def _move(self, pipe, device: str):
+        if self._text_encoder_quantized:
+            pipe.unet.to(device)
+            pipe.vae.to(device)
+        else:
+            pipe.to(device)
+
     @property
     def device(self):
         """Get the current device."""
@@ -288,11 +512,12 @@ class StablePipe:
 
         self._mode = new_mode
         if new_mode == "img2img":
-            self._inpaint_pipe.to("cpu")
-            self._pipe.to("cuda")
+            if self._inpaint_pipe is not None:
+                self._move(self._inpaint_pipe, "cpu")
+            self._move(self._pipe, "cuda")
         elif new_mode == "inpaint":
-            self._pipe.to("cpu")
-            self._inpaint_pipe.to("cuda")
+            self._move(self._pipe, "cpu")
+            self._move(self._inpaint_pipe, "cuda")
         else:
             raise ValueError(
                 '`mode` should be one of "img2img" or "inpaint", '
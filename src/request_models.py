@@ -52,6 +52,7 @@ class BaseDiffusionRequest(BaseModel):
 class BaseImageGenerationRequest(BaseDiffusionRequest):
     num_variants: int = Field(4, gt=0)
     scaling_mode: ScalingMode = ScalingMode.GROW
+    stream_images: bool = False
 
 
 class TextToImageRequest(BaseImageGenerationRequest):
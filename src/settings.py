@@ -6,6 +6,8 @@ Classes:
 
 Variables:
     SETTINGS (Settings) - the loaded settings
+    DEFAULT_CUDA_ALLOC_CONF (str) - allocator config used when
+        `PYTORCH_CUDA_ALLOC_CONF` is not set
 """
 
 
@@ -21,6 +23,7 @@ from typing import Optional
 from diffusers.utils import DIFFUSERS_CACHE
 from dotenv import load_dotenv
 from pydantic import BaseSettings, Field, validator
+import torch
 
 from utils import resolve_path
 
@@ -36,6 +39,9 @@ class Settings(BaseSettings):
     LOG_FILE_PATH = Field("./log/server.log", env="LOG_FILE_PATH")
     DIFFUSERS_CACHE_PATH: str = Field(DIFFUSERS_CACHE, env="DIFFUSERS_CACHE_PATH")
     USE_OPTIMIZED_MODE: bool = Field(True, env="USE_OPTIMIZED_MODE")
+    QUANTIZE_TEXT_ENCODER: bool = Field(False, env="QUANTIZE_TEXT_ENCODER")
+    USE_TORCH_COMPILE: bool = Field(False, env="USE_TORCH_COMPILE")
+    CUDA_MEMORY_FRACTION: float = Field(0.9, gt=0, le=1, env="CUDA_MEMORY_FRACTION")
 
     # TODO make abspath from current file
     @validator("DIFFUSERS_CACHE_PATH", "LOG_FILE_PATH", always=True)
@@ -47,4 +53,16 @@ class Settings(BaseSettings):
 
 
 load_dotenv(environ.get("IMAGE_AI_UTILS_SERVER_DOTENV_PATH") or resolve_path(".env"))
+
+# Batch sizes and image sizes change between requests, which fragments the
+# caching allocator. Expandable segments (torch >= 2.1) let freed blocks be
+# reused by differently-shaped allocations; older versions can only cap the
+# size of blocks that get split. The allocator reads this lazily on first CUDA
+# use, so setting it after `import torch` is fine.
+DEFAULT_CUDA_ALLOC_CONF = (
+    "expandable_segments:True,max_split_size_mb:512"
+    if torch.__version__ >= "2.1"
+    else "max_split_size_mb:512"
+)
+environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", DEFAULT_CUDA_ALLOC_CONF)
 SETTINGS = Settings()